@@ -4,21 +4,40 @@
 # HUID:
 #####################################################
 
+from packet import Packet
 from router import Router
-import json
+from sys import intern
+
+# Dùng orjson nếu có (nhanh hơn nhiều), không thì json chuẩn với dấu phân cách gọn
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+    loads = json.loads
 
 INFINITY = 16  # Giá trị infinity cho DV
+FULL_UPDATE_INTERVAL = 5  # Cứ mỗi bấy nhiêu heartbeat thì gửi lại toàn bộ vector
 
 class DVrouter(Router):
     """Distance vector routing protocol implementation."""
 
     def __init__(self, addr, heartbeat_time):
-        Router.__init__(self, addr)
+        # Địa chỉ được intern để so sánh khóa dict chỉ cần so sánh con trỏ
+        Router.__init__(self, intern(addr))
         self.heartbeat_time = heartbeat_time
         self.last_time = 0
 
-        # Bảng chi phí đến các đích: {dest: (cost, next_hop_port)}
-        self.forwarding_table = {}
+        # Port ra cho từng đích: {dest: next_hop_port}; chi phí nằm trong distance_vector
+        self._fwd_port = {}
 
         # Distance vector của chính router này: {dest: cost}
         self.distance_vector = {self.addr: 0}
@@ -29,19 +48,43 @@ class DVrouter(Router):
         # Lưu thông tin các link trực tiếp: {port: (neighbor_addr, cost)}
         self.links = {}
 
+        # Vector (đã poison) gửi lần gần nhất qua từng port: {port: {dest: cost}}
+        self._last_sent_per_port = {}
+        # Số thứ tự của gói cập nhật: gửi đi qua từng port (tăng mãi, không reset)
+        # và gói mới nhất đã áp dụng từ từng port (xóa khi link thay đổi)
+        self._sent_seq_per_port = {}
+        self._recv_seq_per_port = {}
+        self.heartbeat_count = 0
+        # Có thay đổi kể từ heartbeat trước hay không
+        self._dirty_since_last_heartbeat = False
+
     def handle_packet(self, port, packet):
         """Process incoming packet."""
         if packet.is_traceroute:
             # Gói dữ liệu: chuyển tiếp nếu biết đường đi
-            dst = packet.dst_addr
-            if dst in self.forwarding_table:
-                out_port = self.forwarding_table[dst][1]
+            out_port = self._fwd_port.get(packet.dst_addr)
+            if out_port is not None:
                 self.send(out_port, packet)
         else:
             # Gói định tuyến: cập nhật vector của hàng xóm
-            content = json.loads(packet.content)
-            neighbor = packet.src_addr
-            self.neighbor_vectors[neighbor] = content
+            content = loads(packet.content)
+            # Gói đến trễ (cũ hơn gói đã áp dụng) thì bỏ. Nếu bị hụt gói ở giữa,
+            # các đích mà gói bị hụt mang theo vẫn cũ cho đến lần gửi toàn bộ kế tiếp
+            seq = content["seq"]
+            last_seq = self._recv_seq_per_port.get(port)
+            if last_seq is not None and seq <= last_seq:
+                return
+            self._recv_seq_per_port[port] = seq
+            neighbor = intern(packet.src_addr)
+            vector = {intern(dest): cost for dest, cost in content["vector"].items()}
+            if content.get("full"):
+                self.neighbor_vectors[neighbor] = vector
+            else:
+                # Gói delta: chỉ chứa các đích thay đổi và các đích đã bị xóa
+                neighbor_vec = self.neighbor_vectors.setdefault(neighbor, {})
+                neighbor_vec.update(vector)
+                for dest in content["removed"]:
+                    neighbor_vec.pop(dest, None)
 
             # Cập nhật lại distance vector và forwarding table
             changed = self.update_distance_vector()
@@ -50,15 +93,24 @@ class DVrouter(Router):
 
     def handle_new_link(self, port, endpoint, cost):
         """Handle new link."""
+        endpoint = intern(endpoint)
         self.links[port] = (endpoint, cost)
+        # Hàng xóm mới cần nhận toàn bộ vector
+        self._last_sent_per_port.pop(port, None)
+        self._recv_seq_per_port.pop(port, None)
         if endpoint not in self.neighbor_vectors:
             self.neighbor_vectors[endpoint] = {}
         changed = self.update_distance_vector()
         if changed:
             self.broadcast_distance_vector()
+        else:
+            # Chưa gửi gì cho hàng xóm mới: để heartbeat kế tiếp gửi
+            self._dirty_since_last_heartbeat = True
 
     def handle_remove_link(self, port):
         """Handle removed link."""
+        self._last_sent_per_port.pop(port, None)
+        self._recv_seq_per_port.pop(port, None)
         if port in self.links:
             neighbor, _ = self.links[port]
             del self.links[port]
@@ -67,67 +119,108 @@ class DVrouter(Router):
             changed = self.update_distance_vector()
             if changed:
                 self.broadcast_distance_vector()
+            else:
+                self._dirty_since_last_heartbeat = True
 
     def handle_time(self, time_ms):
         """Handle current time."""
         if time_ms - self.last_time >= self.heartbeat_time:
             self.last_time = time_ms
-            self.broadcast_distance_vector()
-
-    def broadcast_distance_vector(self):
-        # Gửi distance vector của mình cho tất cả hàng xóm, áp dụng poison reverse
+            self.heartbeat_count += 1
+            # Định kỳ gửi toàn bộ vector để đồng bộ lại nếu delta bị lệch;
+            # các heartbeat khác chỉ gửi khi có thay đổi từ lần trước
+            full = self.heartbeat_count % FULL_UPDATE_INTERVAL == 0
+            if full or self._dirty_since_last_heartbeat:
+                self._dirty_since_last_heartbeat = False
+                self.broadcast_distance_vector(full=full)
+
+    def broadcast_distance_vector(self, full=False):
+        # Gửi distance vector của mình cho tất cả hàng xóm, áp dụng poison reverse.
+        # Mặc định chỉ gửi các đích thay đổi so với lần gửi trước qua cùng port.
+        # Gom các đích theo port của đường tốt nhất, chỉ cần một lượt duyệt
+        poisoned_by_port = {}
+        for dest, out_port in self._fwd_port.items():
+            poisoned_by_port.setdefault(out_port, []).append(dest)
+        # Tính sẵn nội dung cho từng port rồi gửi cả loạt
+        outgoing = []
         for port, (neighbor, _) in self.links.items():
-            poisoned_vector = {}
-            for dest, cost in self.distance_vector.items():
-                # Nếu đường tốt nhất đến dest là qua neighbor này, báo INFINITY (poison reverse)
-                if dest != neighbor and dest in self.forwarding_table and self.forwarding_table[dest][1] == port:
+            poisoned_vector = self.distance_vector.copy()
+            # Nếu đường tốt nhất đến dest là qua neighbor này, báo INFINITY (poison reverse)
+            for dest in poisoned_by_port.get(port, ()):
+                if dest != neighbor:
                     poisoned_vector[dest] = INFINITY
-                else:
-                    poisoned_vector[dest] = cost
-            content = json.dumps(poisoned_vector)
-            from packet import Packet
-            pkt = Packet(Packet.ROUTING, self.addr, neighbor, content)
-            self.send(port, pkt)
+            last_sent = self._last_sent_per_port.get(port)
+            if full or last_sent is None:
+                update = {"full": True, "vector": poisoned_vector}
+            else:
+                changed = {dest: cost for dest, cost in poisoned_vector.items() if last_sent.get(dest) != cost}
+                removed = [dest for dest in last_sent if dest not in poisoned_vector]
+                if not changed and not removed:
+                    continue
+                update = {"vector": changed, "removed": removed}
+            self._last_sent_per_port[port] = poisoned_vector
+            seq = self._sent_seq_per_port.get(port, 0) + 1
+            self._sent_seq_per_port[port] = seq
+            update["seq"] = seq
+            outgoing.append((port, neighbor, dumps(update)))
+        if outgoing:
+            # Dùng lại một đối tượng Packet: link sao chép gói ngay khi gửi
+            send = self.send
+            pkt = Packet(Packet.ROUTING, self.addr, None)
+            for port, neighbor, content in outgoing:
+                pkt.dst_addr = neighbor
+                pkt.content = content
+                send(port, pkt)
 
     def update_distance_vector(self):
         """Tính lại distance vector và forwarding table. Trả về True nếu có thay đổi."""
+        INF = INFINITY  # biến cục bộ, tra cứu nhanh hơn biến toàn cục trong vòng lặp
         updated = False
-        new_distance_vector = {self.addr: 0}
-        new_forwarding_table = {}
-
-        # Tập hợp tất cả đích có thể biết
-        destinations = set([self.addr])
-        for vec in self.neighbor_vectors.values():
-            destinations.update(vec.keys())
-        for _, (neighbor, _) in self.links.items():
-            destinations.add(neighbor)
-
-        for dest in destinations:
-            if dest == self.addr:
-                continue
-            min_cost = INFINITY
-            min_port = None
-            # Xét từng hàng xóm
-            for port, (neighbor, link_cost) in self.links.items():
-                neighbor_vec = self.neighbor_vectors.get(neighbor, {})
-                neighbor_cost = neighbor_vec.get(dest, INFINITY)
-                # Nếu neighbor_cost >= INFINITY thì coi như không có đường
+
+        # Một lượt duyệt duy nhất: nới lỏng trực tiếp các đích mà từng hàng xóm biết.
+        # Duyệt port theo thứ tự và chỉ thay khi tốt hơn hẳn nên port đầu tiên vẫn thắng khi hòa.
+        # Chính router này được gán sẵn chi phí 0 nên không đường nào thay được nó.
+        # Chi phí và port tốt nhất giữ trong hai dict riêng, không phải tạo tuple.
+        best_cost = {self.addr: 0}
+        best_port = {}
+        for port, (neighbor, link_cost) in self.links.items():
+            # Đường trực tiếp tới neighbor; mục của neighbor trong vector của nó luôn là 0
+            # nên khi duyệt vector bên dưới cũng không thay đổi kết quả này
+            current = best_cost.get(neighbor)
+            if current is None or link_cost < current:
+                best_cost[neighbor] = link_cost
+                best_port[neighbor] = port
+            for dest, neighbor_cost in self.neighbor_vectors.get(neighbor, {}).items():
+                # Đích không tới được qua neighbor này (kể cả bị poison): bỏ qua ngay
+                if neighbor_cost >= INF:
+                    continue
                 total_cost = link_cost + neighbor_cost
-                # Nếu dest là neighbor trực tiếp thì ưu tiên đường trực tiếp
-                if dest == neighbor:
-                    total_cost = link_cost
-                if total_cost < min_cost:
-                    min_cost = total_cost
-                    min_port = port
-            if min_cost < INFINITY:
+                current = best_cost.get(dest)
+                if current is None or total_cost < current:
+                    best_cost[dest] = total_cost
+                    best_port[dest] = port
+        del best_cost[self.addr]
+
+        old_distance_vector = self.distance_vector
+        old_fwd_port = self._fwd_port
+        new_distance_vector = {self.addr: 0}
+        new_fwd_port = {}
+        for dest, min_cost in best_cost.items():
+            if min_cost < INF:
+                min_port = best_port[dest]
                 new_distance_vector[dest] = min_cost
-                new_forwarding_table[dest] = (min_cost, min_port)
-
-        # Kiểm tra thay đổi
-        if new_distance_vector != self.distance_vector or new_forwarding_table != self.forwarding_table:
-            self.distance_vector = new_distance_vector
-            self.forwarding_table = new_forwarding_table
+                new_fwd_port[dest] = min_port
+                # Đánh dấu thay đổi ngay khi ghi, tránh so sánh cả dict ở cuối
+                if not updated and (old_distance_vector.get(dest) != min_cost
+                                    or old_fwd_port.get(dest) != min_port):
+                    updated = True
+
+        # Đích bị mất (không còn đường) làm số phần tử giảm
+        if not updated and len(new_distance_vector) != len(old_distance_vector):
             updated = True
+        if updated:
+            self.distance_vector = new_distance_vector
+            self._fwd_port = new_fwd_port
         return updated
 
     def __repr__(self):
@@ -5,131 +5,230 @@
 
 from packet import Packet
 from router import Router
-import json
-import networkx as nx
+import heapq
+from collections import OrderedDict
+from sys import intern
+
+# orjson is much faster when available; otherwise emit compact stdlib JSON
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+    loads = json.loads
+
+
+SPT_CACHE_SIZE = 16  # Number of recent topologies whose shortest-path state is kept
+REFRESH_INTERVAL = 3  # Heartbeats between unconditional LS refreshes
+
+
+def build_csr(link_state):
+    """Flatten the LSDB into compressed sparse row lists.
+
+    Returns (addr_id, id_addr, offsets, neighbors, weights). The edges of
+    node u are neighbors[offsets[u]:offsets[u + 1]] with matching weights.
+    Routers that advertised a link state get the first ids; endpoints only
+    seen as neighbors (e.g. clients) follow and have no outgoing edges.
+    """
+    id_addr = list(link_state)
+    addr_id = {addr: node for node, addr in enumerate(id_addr)}
+    offsets = [0]
+    neighbors = []
+    weights = []
+    for adjacency in link_state.values():
+        for neighbor, cost in adjacency.items():
+            node = addr_id.get(neighbor)
+            if node is None:
+                node = addr_id[neighbor] = len(id_addr)
+                id_addr.append(neighbor)
+            neighbors.append(node)
+            weights.append(cost)
+        offsets.append(len(neighbors))
+    offsets.extend([len(neighbors)] * (len(id_addr) - len(link_state)))
+    return addr_id, id_addr, offsets, neighbors, weights
+
+
+def extend_spt(csr, frontier, visited, forwarding_table, target):
+    """Continue Dijkstra until target is settled or the frontier is empty.
+
+    Heap entries are (dist, node id, port), where port is the outgoing port
+    of the first hop, so settling a node writes its forwarding entry
+    directly. Every node settled on the way gets its entry, so later
+    lookups for them are plain dict hits. Edges are read from contiguous
+    slices of the CSR lists and visited is a bytearray indexed by id.
+    """
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    addr_id, id_addr, offsets, neighbors, weights = csr
+    target = addr_id.get(target)
+    while frontier:
+        dist, node, port = heappop(frontier)
+        if visited[node]:
+            continue
+        visited[node] = 1
+        forwarding_table[id_addr[node]] = (port, dist)
+        start = offsets[node]
+        end = offsets[node + 1]
+        for neighbor, cost in zip(neighbors[start:end], weights[start:end]):
+            if not visited[neighbor]:
+                heappush(frontier, (dist + cost, neighbor, port))
+        if node == target:
+            break
+
 
 class LSrouter(Router):
     """Link state routing protocol implementation (fixed)."""
 
     def __init__(self, addr, heartbeat_time):
-        super().__init__(addr)  # Initialize base class
+        super().__init__(intern(addr))  # Initialize base class
         self.heartbeat_time = heartbeat_time
         self.last_time = 0
         # Maps router to its link state (neighbors and costs)
         self.link_state = {self.addr: {}}
         # Maps router to its latest sequence number
         self.sequence_numbers = {self.addr: 0}
-        # Undirected network graph for shortest path computation
-        self.graph = nx.Graph()
-        # Maps destination to (port, cost)
+        # Maps destination to (port, cost), filled in on demand
         self.forwarding_table = {}
+        # CSR form of the LSDB and the unexplored part of the shortest-path
+        # tree (heap and settled flags), all indexed by node id
+        self._csr = build_csr(self.link_state)
+        self._frontier = []
+        self._visited = bytearray(1)
+        # LRU of shortest-path state keyed by LSDB signature
+        self._spt_cache = OrderedDict()
+        # Maps directly connected neighbor to its port
+        self._neighbor_port = {}
+        self.heartbeat_count = 0
 
     def handle_packet(self, port, packet):
         """Process incoming packet."""
         if packet.kind == Packet.ROUTING:
-            received = json.loads(packet.content)
-            src = received["src"]
-            seq_num = received["seq_num"]
-            neighbors = received["neighbors"]
+            # "seq\nsrc\n" header: stale flood copies are dropped unparsed
+            seq_num, src, body = packet.content.split("\n", 2)
+            seq_num = int(seq_num)
             # Newer sequence number => update LS database
             if seq_num > self.sequence_numbers.get(src, -1):
+                src = intern(src)
+                neighbors = loads(body)
                 self.sequence_numbers[src] = seq_num
-                self.link_state[src] = neighbors
-                self.update_graph()
+                # Periodic refreshes usually carry an unchanged link state
+                if self.link_state.get(src) != neighbors:
+                    self.link_state[src] = {intern(neighbor): cost
+                                            for neighbor, cost in neighbors.items()}
+                    self.update_graph()
                 # Flood to all neighbors except incoming
                 self.flood(packet.content, exclude_port=port)
         elif packet.is_traceroute:
             # Forward traceroute based on forwarding table
-            next_hop = self.forwarding_table.get(packet.dst_addr)
+            next_hop = self.lookup(packet.dst_addr)
             if next_hop:
                 self.send(next_hop[0], packet)
 
     def handle_new_link(self, port, endpoint, cost):
         """Handle new link."""
+        endpoint = intern(endpoint)
+        self._neighbor_port[endpoint] = port
         # Add bidirectional link cost
         self.link_state.setdefault(self.addr, {})[endpoint] = cost
         self.link_state.setdefault(endpoint, {})[self.addr] = cost
         self.sequence_numbers[self.addr] += 1
+        self.update_graph()
         self.broadcast_link_state()
 
     def handle_remove_link(self, port):
         """Handle removed link."""
-        # Remove both directions
-        neighbors = self.link_state.get(self.addr, {})
-        for neighbor in list(neighbors):
-            if self.get_port_for_neighbor(neighbor) is None:
-                del neighbors[neighbor]
-                # Also remove reverse link
-                if neighbor in self.link_state:
-                    self.link_state[neighbor].pop(self.addr, None)
+        # Router.remove_link has already dropped the port from self.links,
+        # so the neighbor is recovered from the port map
+        removed = [neighbor for neighbor, neighbor_port in self._neighbor_port.items()
+                   if neighbor_port == port]
+        if not removed:
+            return
+        for neighbor in removed:
+            del self._neighbor_port[neighbor]
+            # Remove both directions
+            self.link_state[self.addr].pop(neighbor, None)
+            self.link_state.get(neighbor, {}).pop(self.addr, None)
         self.sequence_numbers[self.addr] += 1
         self.update_graph()
         self.broadcast_link_state()
 
     def handle_time(self, time_ms):
-        """Periodic heartbeat to rebroadcast own LS."""
+        """Periodic heartbeat to rebroadcast own LS when a refresh is due."""
         if time_ms - self.last_time >= self.heartbeat_time:
             self.last_time = time_ms
-            self.sequence_numbers[self.addr] += 1
-            self.broadcast_link_state()
+            self.heartbeat_count += 1
+            # Link changes already flood at once; this only refreshes the LSDB
+            if self.heartbeat_count % REFRESH_INTERVAL == 0:
+                self.sequence_numbers[self.addr] += 1
+                self.broadcast_link_state()
 
     def update_graph(self):
-        """Update the network graph based on the current link state."""
-        self.graph.clear()
-        for router, neighbors in self.link_state.items():
-            for neighbor, cost in neighbors.items():
-                # Add undirected edge
-                self.graph.add_edge(router, neighbor, weight=cost)
-        self.update_forwarding_table()
-
-    def update_forwarding_table(self):
-        """Compute shortest paths and build forwarding table."""
-        self.forwarding_table.clear()
-        try:
-            paths = nx.single_source_dijkstra_path(self.graph, self.addr)
-            for dest, path in paths.items():
-                if len(path) < 2:
-                    continue
-                next_hop = path[1]
-                port = self.get_port_for_neighbor(next_hop)
-                cost = self.graph[self.addr][next_hop]["weight"]
-                if port is not None:
-                    self.forwarding_table[dest] = (port, cost)
-        except nx.NetworkXNoPath:
-            pass
+        """Reset the lazy forwarding state for the current link state."""
+        key = self.lsdb_signature()
+        cached = self._spt_cache.get(key)
+        if cached is not None:
+            self._spt_cache.move_to_end(key)
+        else:
+            csr = build_csr(self.link_state)
+            addr_id = csr[0]
+            # Each direct neighbor starts a path leaving through its port
+            frontier = [(cost, addr_id[neighbor], self._neighbor_port[neighbor])
+                        for neighbor, cost in self.link_state.get(self.addr, {}).items()
+                        if neighbor in self._neighbor_port]
+            heapq.heapify(frontier)
+            visited = bytearray(len(addr_id))
+            visited[addr_id[self.addr]] = 1
+            cached = ({}, csr, frontier, visited)
+            self._spt_cache[key] = cached
+            if len(self._spt_cache) > SPT_CACHE_SIZE:
+                self._spt_cache.popitem(last=False)
+        self.forwarding_table, self._csr, self._frontier, self._visited = cached
+
+    def lsdb_signature(self):
+        """Hashable snapshot of the link state and of the local ports."""
+        ports = frozenset(self._neighbor_port.items())
+        lsdb = frozenset(
+            (router, frozenset(neighbors.items()))
+            for router, neighbors in self.link_state.items()
+        )
+        return lsdb, ports
+
+    def lookup(self, dst):
+        """Return the (port, cost) forwarding entry for dst, or None."""
+        entry = self.forwarding_table.get(dst)
+        if entry is None and self._frontier:
+            extend_spt(self._csr, self._frontier, self._visited,
+                       self.forwarding_table, dst)
+            entry = self.forwarding_table.get(dst)
+        return entry
 
     def broadcast_link_state(self, content=None):
         """Broadcast the link state of this router to all neighbors."""
         if content is None:
-            info = {
-                "src": self.addr,
-                "seq_num": self.sequence_numbers[self.addr],
-                "neighbors": self.link_state.get(self.addr, {})
-            }
-            content = json.dumps(info)
+            # "seq_num\nsrc\n" header, then the JSON neighbor -> cost map
+            content = (f"{self.sequence_numbers[self.addr]}\n{self.addr}\n"
+                       + dumps(self.link_state.get(self.addr, {})))
         # Send to all current neighbors
-        for neighbor in self.link_state.get(self.addr, {}):
-            port = self.get_port_for_neighbor(neighbor)
-            if port is not None:
-                pkt = Packet(kind=Packet.ROUTING, src_addr=self.addr,
-                             dst_addr=neighbor, content=content)
-                self.send(port, pkt)
+        self.flood(content, exclude_port=None)
 
     def flood(self, content, exclude_port):
         """Forward LS packet to all neighbors except the one it came from."""
-        for neighbor in self.link_state.get(self.addr, {}):
-            port = self.get_port_for_neighbor(neighbor)
-            if port is not None and port != exclude_port:
-                pkt = Packet(kind=Packet.ROUTING, src_addr=self.addr,
-                             dst_addr=neighbor, content=content)
-                self.send(port, pkt)
-
-    def get_port_for_neighbor(self, neighbor):
-        """Get the port for a given neighbor."""
-        for port, link in self.links.items():
-            if link.e1 == neighbor or link.e2 == neighbor:
-                return port
-        return None
+        # One packet is retargeted per neighbor; the link copies it on send
+        send = self.send
+        pkt = Packet(kind=Packet.ROUTING, src_addr=self.addr,
+                     dst_addr=None, content=content)
+        for neighbor, port in self._neighbor_port.items():
+            if port != exclude_port:
+                pkt.dst_addr = neighbor
+                send(port, pkt)
 
     def __repr__(self):
         return f"LSrouter(addr={self.addr}, LSDB={self.link_state})"
\ No newline at end of file